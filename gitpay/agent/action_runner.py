@@ -4,9 +4,14 @@ import json
 import logging
 import requests
 from web3 import Web3
+from web3.exceptions import TimeExhausted, TransactionNotFound
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 from dotenv import load_dotenv
+
+import dead_letter
+from retry import CircuitBreaker, RetryPolicy, StageFailed, TransientError, run_stage
+
 load_dotenv()
 # --- 1. UNIVERSAL COMPATIBILITY FIX ---
 try:
@@ -26,7 +31,53 @@ ERC20_ABI = [
     {"constant": True, "inputs": [], "name": "decimals", "outputs": [{"name": "", "type": "uint8"}], "type": "function"},
 ]
 
+# Per-stage retry policies and one circuit breaker per external dependency
+STAGES = ["extract", "funding", "sign", "payout", "confirm"]
+
+STAGE_POLICIES = {
+    "extract": RetryPolicy(max_attempts=3, base_delay=2.0),
+    "funding": RetryPolicy(max_attempts=4, base_delay=1.0),
+    "sign": RetryPolicy(max_attempts=3, base_delay=3.0),
+    "payout": RetryPolicy(max_attempts=3, base_delay=3.0),
+    "confirm": RetryPolicy(max_attempts=5, base_delay=5.0, max_delay=60.0),
+}
+
+# Dead letters are replayed hourly, so this gives up on an entry after about a day
+DEFAULT_DLQ_MAX_FAILURES = 24
+
+# Each threshold equals the longest policy using that breaker, so the circuit only
+# opens once a stage has used up its own attempts and never cuts them short
+BREAKERS = {
+    "gemini": CircuitBreaker("gemini", failure_threshold=3),
+    "x402": CircuitBreaker("x402", failure_threshold=4),
+    "cronos": CircuitBreaker("cronos", failure_threshold=5),
+}
+
 # --- MODULE 1: AI AGENT EXTRACTION ---
+try:
+    import httpx
+    LLM_NETWORK_ERRORS = (TimeoutError, ConnectionError, requests.ConnectionError, requests.Timeout, httpx.TransportError)
+except ImportError:
+    LLM_NETWORK_ERRORS = (TimeoutError, ConnectionError, requests.ConnectionError, requests.Timeout)
+
+def _is_retryable_llm_error(error) -> bool:
+    """
+    Only network failures, timeouts (408), rate limits (429) and 5xx are worth retrying.
+    The Gemini client wraps the HTTP error, so the status code is looked up along the cause chain.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, LLM_NETWORK_ERRORS):
+            return True
+        code = getattr(error, "code", None)
+        if not isinstance(code, int):
+            code = getattr(error, "status_code", None)
+        if isinstance(code, int) and 100 <= code < 600:
+            return code in (408, 429) or code >= 500
+        error = error.__cause__ or error.__context__
+    return False
+
 def extract_details_with_agent(pr_text: str):
     """
     Strictly uses Gemini AI to interpret the PR text.
@@ -66,7 +117,14 @@ def extract_details_with_agent(pr_text: str):
 
     try:
         response = llm.invoke([HumanMessage(content=prompt)])
-        
+    except Exception as e:
+        if _is_retryable_llm_error(e):
+            raise TransientError(f"Gemini call failed: {e}") from e
+        # Bad key, unknown model, rejected request: retrying can't help
+        logger.error(f"❌ Gemini rejected the request: {e}")
+        return None, None
+
+    try:
         # Clean the response (sometimes AI adds ```json blocks)
         content = response.content.replace("```json", "").replace("```", "").strip()
         data = json.loads(content)
@@ -87,10 +145,14 @@ def extract_details_with_agent(pr_text: str):
 
 # --- MODULE 2: FUNDING CHECK ---
 def check_funding_status(owner, repo, issue_number):
+    """
+    Returns (True, amount) when funded, (False, 0) only when the backend explicitly
+    says the issue is not funded, and (None, 0) when its answer can't be trusted.
+    """
     service_url = os.getenv("X402_SERVICE_URL", "").strip()
     if not service_url:
         logger.error("❌ X402_SERVICE_URL missing. Cannot verify funding.")
-        return False, 0
+        return None, 0
 
     url = f"{service_url.rstrip('/')}/bounties/status"
     params = {"owner": owner, "repo": repo, "issueNumber": issue_number}
@@ -99,36 +161,79 @@ def check_funding_status(owner, repo, issue_number):
 
     try:
         resp = requests.get(url, params=params, timeout=15)
-        
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("funded") is True:
-                rec = data.get("record", {}) or {}
-                # Handle potential casing differences
-                raw_amt = rec.get("amount_base_units") or rec.get("amountBaseUnits")
-                if raw_amt:
-                    return True, int(raw_amt)
-        
-        if resp.status_code == 404:
-            logger.info(f"msg='Not Funded' issue={issue_number}")
-            return False, 0
-            
-    except Exception as e:
-        logger.error(f"❌ Backend connection failed: {e}")
-    
-    return False, 0
+    except requests.RequestException as e:
+        raise TransientError(f"Backend connection failed: {e}") from e
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise TransientError(f"Backend returned HTTP {resp.status_code}")
+
+    try:
+        data = resp.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        logger.error(f"❌ Backend returned a non-JSON response (HTTP {resp.status_code})")
+        return None, 0
+
+    # The backend answers 404 {"funded": false} for unfunded issues; any other 404 (e.g. a stale tunnel URL) is an error
+    if resp.status_code == 404 and data.get("funded") is False:
+        logger.info(f"msg='Not Funded' issue={issue_number}")
+        return False, 0
+
+    if resp.status_code != 200 or data.get("funded") is not True:
+        logger.error(f"❌ Unexpected funding response (HTTP {resp.status_code}): {data}")
+        return None, 0
+
+    rec = data.get("record")
+    if not isinstance(rec, dict):
+        logger.error(f"❌ Funded response is missing its record: {data}")
+        return None, 0
+
+    # Handle potential casing differences
+    raw_amt = rec.get("amount_base_units") or rec.get("amountBaseUnits")
+    try:
+        amount = int(raw_amt)
+    except (TypeError, ValueError):
+        amount = 0
+    if amount <= 0:
+        logger.error(f"❌ Funded record has no valid amount: {rec}")
+        return None, 0
+
+    return True, amount
 
 # --- MODULE 3: BLOCKCHAIN PAYOUT ---
-def execute_payout(to_address: str, amount_base_units: int):
+DRY_RUN_TX_HASH = "DRY_RUN_TX_HASH"
+
+# Only failures to reach the RPC node are retried; anything the node answers is final
+RPC_CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+# Rejections meaning the signed tx's nonce was taken by another transaction
+NONCE_CONSUMED_ERRORS = ("nonce too low", "replacement transaction underpriced")
+
+# Re-sign / re-send rounds per run before the job is dead-lettered
+MAX_PAYOUT_ROUNDS = 3
+
+class NonceConsumed(Exception):
+    """The signed payout was never accepted and its nonce is used, so it can never be mined."""
+
+class TxDropped(Exception):
+    """The broadcast payout left the mempool unmined; the same signed bytes must be re-sent."""
+
+def _connect_web3():
+    w3 = Web3(Web3.HTTPProvider(RPC_URL))
+    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+    return w3
+
+def sign_payout(to_address: str, amount_base_units: int):
+    """
+    Builds and signs the transfer without broadcasting it.
+    Returns (raw_tx, tx_hash) as hex strings, or None on a permanent failure.
+    """
     # Check for Dry Run mode (useful for testing Agent logic without spending money)
     dry_run = os.getenv("GITPAY_DRY_RUN", "0") == "1"
     if dry_run:
         logger.info(f"🧪 [DRY RUN] Would pay {amount_base_units} to {to_address}. Skipping TX.")
-        return "DRY_RUN_TX_HASH"
-
-    logger.info("🔗 Agent connecting to Cronos Blockchain...")
-    w3 = Web3(Web3.HTTPProvider(RPC_URL))
-    w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+        return None, DRY_RUN_TX_HASH
 
     priv_key = os.getenv("CRONOS_PRIVATE_KEY", "").strip()
     if not priv_key:
@@ -136,48 +241,241 @@ def execute_payout(to_address: str, amount_base_units: int):
         return None
 
     try:
+        target = Web3.to_checksum_address(to_address)
+    except ValueError as e:
+        logger.error(f"❌ Invalid payee address {to_address}: {e}")
+        return None
+
+    logger.info("🔗 Agent connecting to Cronos Blockchain...")
+    try:
+        w3 = _connect_web3()
         account = w3.eth.account.from_key(priv_key)
         contract = w3.eth.contract(address=Web3.to_checksum_address(USDC_CONTRACT), abi=ERC20_ABI)
 
-        sender = account.address
-        target = Web3.to_checksum_address(to_address)
-
-        logger.info(f"💸 Initiating Transfer: {amount_base_units} units -> {target}")
+        logger.info(f"💸 Preparing Transfer: {amount_base_units} units -> {target}")
 
+        # "pending" queues behind payouts from other runs instead of replacing them
         tx = contract.functions.transfer(target, int(amount_base_units)).build_transaction({
             "chainId": CHAIN_ID,
             "gas": 150000,
             "gasPrice": w3.eth.gas_price,
-            "nonce": w3.eth.get_transaction_count(sender),
+            "nonce": w3.eth.get_transaction_count(account.address, "pending"),
         })
+    except RPC_CONNECTION_ERRORS as e:
+        raise TransientError(f"RPC connection failed: {e}") from e
+    except Exception as e:
+        logger.error(f"❌ Blockchain Error: {e}")
+        return None
 
-        signed_tx = w3.eth.account.sign_transaction(tx, priv_key)
-        
-        # Universal attribute fix
-        raw_tx = getattr(signed_tx, "rawTransaction", None) or getattr(signed_tx, "raw_transaction", None)
-        if raw_tx is None:
-            raise AttributeError("rawTransaction missing on signed object")
+    signed_tx = w3.eth.account.sign_transaction(tx, priv_key)
 
-        tx_hash = w3.eth.send_raw_transaction(raw_tx)
-        logger.info(f"⏳ Tx Sent: {tx_hash.hex()}. Waiting for confirmation...")
-        
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    # Universal attribute fix
+    raw_tx = getattr(signed_tx, "rawTransaction", None) or getattr(signed_tx, "raw_transaction", None)
+    if raw_tx is None:
+        raise AttributeError("rawTransaction missing on signed object")
+
+    return Web3.to_hex(raw_tx), Web3.to_hex(Web3.keccak(raw_tx))
 
-        if receipt.status == 1:
-            logger.info("✅ Payout Confirmed!")
-            return tx_hash.hex()
-        else:
-            logger.error("❌ Transaction Reverted on-chain.")
-            return None
+def _tx_known(w3, tx_hash: str) -> bool:
+    try:
+        w3.eth.get_transaction(tx_hash)
+        return True
+    except TransactionNotFound:
+        return False
+
+def broadcast_payout(raw_tx: str, tx_hash: str) -> bool:
+    """
+    Sends the already-signed transfer. Safe to repeat: a hash the node already knows
+    is never re-sent, and a re-send carries the same nonce and signature.
+    """
+    if tx_hash == DRY_RUN_TX_HASH:
+        return True
 
+    w3 = _connect_web3()
+    try:
+        if _tx_known(w3, tx_hash):
+            logger.info(f"⏳ Tx {tx_hash} already broadcast, skipping send.")
+            return True
+        w3.eth.send_raw_transaction(raw_tx)
+    except RPC_CONNECTION_ERRORS as e:
+        raise TransientError(f"RPC connection failed: {e}") from e
     except Exception as e:
-        logger.error(f"❌ Blockchain Error: {e}")
-        return None
+        rejection = e
+    else:
+        logger.info(f"⏳ Tx Sent: {tx_hash}")
+        return True
+
+    # Another tx took this nonce. If ours is unknown to the node it can never be mined,
+    # so re-signing with a fresh nonce can't pay twice.
+    if any(m in str(rejection).lower() for m in NONCE_CONSUMED_ERRORS):
+        try:
+            known = _tx_known(w3, tx_hash)
+        except RPC_CONNECTION_ERRORS as e:
+            raise TransientError(f"RPC connection failed: {e}") from e
+        if not known:
+            raise NonceConsumed(f"{tx_hash}: {rejection}") from rejection
+
+    # Already known, insufficient funds, ...: never retry a send
+    logger.error(f"❌ Broadcast of {tx_hash} rejected: {rejection}")
+    return False
+
+def wait_for_confirmation(tx_hash: str) -> bool:
+    if tx_hash == DRY_RUN_TX_HASH:
+        return True
+
+    logger.info(f"⏳ Waiting for confirmation of {tx_hash}...")
+    w3 = _connect_web3()
+    try:
+        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    except TimeExhausted as e:
+        # Still pending is worth waiting for; gone from the node means nothing will ever mine it
+        try:
+            known = _tx_known(w3, tx_hash)
+        except RPC_CONNECTION_ERRORS as ce:
+            raise TransientError(f"Receipt lookup failed: {ce}") from ce
+        if not known:
+            raise TxDropped(tx_hash) from e
+        raise TransientError(f"Receipt lookup failed: {e}") from e
+    except RPC_CONNECTION_ERRORS as e:
+        raise TransientError(f"Receipt lookup failed: {e}") from e
+    except Exception as e:
+        logger.error(f"❌ Receipt lookup for {tx_hash} failed: {e}")
+        return False
+
+    if receipt.status == 1:
+        logger.info("✅ Payout Confirmed!")
+        return True
+
+    logger.error("❌ Transaction Reverted on-chain.")
+    return False
+
+# --- PIPELINE ---
+def _fail(job: dict, stage: str, message: str) -> bool:
+    logger.error(message)
+    job["error"] = f"{stage}: {message}"
+    return False
+
+def run_pipeline(job: dict, start_stage: str = "extract") -> bool:
+    """
+    Runs the stages from `start_stage` onwards, filling in `job` as it goes.
+    Returns False on a permanent failure (reason in job["error"]); raises StageFailed when retries are exhausted.
+    """
+    stages = STAGES[STAGES.index(start_stage):]
+
+    if "extract" in stages:
+        # 1. AI Extraction
+        issue_num, wallet = run_stage("extract", extract_details_with_agent, STAGE_POLICIES["extract"], BREAKERS["gemini"], job["pr_context"])
+        if not issue_num or not wallet:
+            return _fail(job, "extract", "❌ Agent could not find 'issue_number' or 'wallet' in the PR text.")
+        job["issue_num"], job["wallet"] = issue_num, wallet
+        logger.info(f"📝 Agent identified: Issue #{issue_num} | Payee: {wallet}")
+
+    if "funding" in stages:
+        # 2. Funding Check
+        is_funded, amount_units = run_stage("funding", check_funding_status, STAGE_POLICIES["funding"], BREAKERS["x402"], job["owner"], job["repo"], job["issue_num"])
+        if is_funded is None:
+            return _fail(job, "funding", f"💀 Agent could not verify funding for Issue #{job['issue_num']}.")
+        if not is_funded:
+            logger.info(f"⏹️ Agent verified Issue #{job['issue_num']} is NOT funded. No action taken.")
+            return True
+        job["amount_units"] = amount_units
+
+    # A signed tx whose nonce was taken by another payout can never be mined, so it is re-signed;
+    # one dropped from the mempool is re-sent as is
+    for _ in range(MAX_PAYOUT_ROUNDS):
+        if "sign" in stages:
+            # 3. Sign (the hash is known and saved in the job before anything is broadcast)
+            logger.info(f"💰 Funding verified ({job['amount_units']} units). Executing payout...")
+            signed = run_stage("sign", sign_payout, STAGE_POLICIES["sign"], BREAKERS["cronos"], job["wallet"], job["amount_units"])
+            if not signed:
+                return _fail(job, "sign", "💀 Agent failed to execute payout.")
+            job["raw_tx"], job["tx_hash"] = signed
+
+        if "payout" in stages:
+            # 4. Broadcast the saved transaction; resumes never re-sign a tx that could still be mined
+            try:
+                sent = run_stage("payout", broadcast_payout, STAGE_POLICIES["payout"], BREAKERS["cronos"], job["raw_tx"], job["tx_hash"])
+            except NonceConsumed as e:
+                logger.warning(f"♻️ Nonce of the signed payout was used by another tx, re-signing: {e}")
+                job.pop("raw_tx", None)
+                job.pop("tx_hash", None)
+                stages = STAGES[STAGES.index("sign"):]
+                continue
+            if not sent:
+                return _fail(job, "payout", f"💀 Agent failed to broadcast payout {job['tx_hash']}.")
+
+        # 5. Confirmation
+        try:
+            confirmed = run_stage("confirm", wait_for_confirmation, STAGE_POLICIES["confirm"], BREAKERS["cronos"], job["tx_hash"])
+        except TxDropped:
+            logger.warning(f"♻️ Payout {job['tx_hash']} dropped from the mempool, re-sending the same signed tx")
+            stages = ["payout", "confirm"]
+            continue
+        if not confirmed:
+            return _fail(job, "confirm", f"💀 Payout {job['tx_hash']} did not succeed on-chain.")
+        break
+    else:
+        raise StageFailed("sign" if "tx_hash" not in job else "payout", f"payout not settled after {MAX_PAYOUT_ROUNDS} rounds")
+
+    logger.info(f"🎉 Agent finished successfully. Tx: {job['tx_hash']}")
+    return True
+
+def replay_dead_letters() -> bool:
+    """
+    Resumes every pending dead letter from the stage it failed at.
+    Permanent failures, and entries that already failed GITPAY_DLQ_MAX_FAILURES times,
+    are marked failed so they are never replayed again.
+    """
+    max_failures = int(os.getenv("GITPAY_DLQ_MAX_FAILURES", DEFAULT_DLQ_MAX_FAILURES))
+    ok = True
+    for letter in dead_letter.pending():
+        job = letter["job"]
+        if letter["failures"] >= max_failures:
+            dead_letter.fail(letter["id"], f"gave up after {letter['failures']} failures: {letter['error']}")
+            logger.error(f"🪦 Giving up on PR #{job.get('pr_number')} at stage '{letter['stage']}' after {letter['failures']} failures: {letter['error']}")
+            ok = False
+            continue
+        logger.info(f"♻️ Replaying PR #{job.get('pr_number')} from stage '{letter['stage']}' (failures so far: {letter['failures']})")
+        try:
+            if run_pipeline(job, start_stage=letter["stage"]):
+                dead_letter.resolve(letter["id"])
+            else:
+                dead_letter.fail(letter["id"], job.get("error") or "permanent failure")
+                ok = False
+        except StageFailed as e:
+            dead_letter.record(job, e.stage, e.error)
+            logger.error(f"📮 Still failing at stage '{e.stage}': {e.error}")
+            ok = False
+    return ok
+
+def import_dead_letters(directory: str) -> int:
+    """
+    Merges the per-run stores found under `directory` (one sub-directory per uploaded artifact)
+    into the shared store. Re-importing the same artifact is a no-op.
+    """
+    imported = 0
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(".db"):
+                source = os.path.relpath(os.path.join(root, name), directory)
+                imported += dead_letter.import_from(os.path.join(root, name), source)
+    logger.info(f"📥 Imported {imported} dead letter(s) from {directory}")
+    return imported
 
 # --- MAIN AGENT LOOP ---
 def main():
     logger.info("🤖 GitPay Agent Starting...")
 
+    args = sys.argv[1:]
+    if "--import" in args:
+        import_dead_letters(args[args.index("--import") + 1])
+        return
+
+    if "--replay" in args:
+        if not replay_dead_letters():
+            sys.exit(1)
+        return
+
     event_path = os.getenv("GITHUB_EVENT_PATH", "").strip()
     if not event_path:
         logger.error("❌ GITHUB_EVENT_PATH missing")
@@ -196,31 +494,18 @@ def main():
     
     # Combine Title + Body + URL for maximum context
     pr_context = f"Title: {pr.get('title','')}\nBody: {pr.get('body','')}\nURL: {pr.get('html_url','')}"
-    
-    # 1. AI Extraction
-    issue_num, wallet = extract_details_with_agent(pr_context)
-
-    if not issue_num or not wallet:
-        logger.error("❌ Agent could not find 'issue_number' or 'wallet' in the PR text.")
-        sys.exit(1)
 
-    logger.info(f"📝 Agent identified: Issue #{issue_num} | Payee: {wallet}")
+    job = {"owner": owner, "repo": repo, "pr_number": pr.get("number"), "pr_context": pr_context}
 
-    # 2. Funding Check
-    is_funded, amount_units = check_funding_status(owner, repo, issue_num)
-    if not is_funded:
-        logger.info(f"⏹️ Agent verified Issue #{issue_num} is NOT funded. No action taken.")
-        return
-
-    # 3. Payout
-    logger.info(f"💰 Funding verified ({amount_units} units). Executing payout...")
-    tx_hash = execute_payout(wallet, amount_units)
-    
-    if not tx_hash:
-        logger.error("💀 Agent failed to execute payout.")
+    try:
+        ok = run_pipeline(job)
+    except StageFailed as e:
+        letter_id = dead_letter.record(job, e.stage, e.error)
+        logger.error(f"📮 Stage '{e.stage}' failed: {e.error}. Saved as dead letter #{letter_id}; rerun with --replay to resume.")
         sys.exit(1)
 
-    logger.info(f"🎉 Agent finished successfully. Tx: {tx_hash}")
+    if not ok:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
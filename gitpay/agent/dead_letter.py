@@ -0,0 +1,131 @@
+import json
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import local_store
+
+DEFAULT_DB_PATH = "gitpay_dead_letters.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    pr_number INTEGER,
+    stage TEXT NOT NULL,
+    job TEXT NOT NULL,
+    error TEXT NOT NULL,
+    failures INTEGER NOT NULL DEFAULT 1,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    resolved_at TEXT
+);
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL
+);
+"""
+
+
+def _connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    return local_store.connect(SCHEMA, "GITPAY_DLQ_DB", DEFAULT_DB_PATH, db_path)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def record(job: Dict[str, Any], stage: str, error: str, db_path: Optional[str] = None) -> int:
+    """
+    Stores a failed job with the stage to resume from.
+    Re-failing a pending entry for the same PR updates it instead of adding a duplicate.
+    """
+    now = _now()
+    with closing(_connect(db_path)) as conn, conn:
+        row = conn.execute(
+            """
+            SELECT id FROM dead_letters
+            WHERE owner = ? AND repo = ? AND pr_number IS ? AND status = 'pending'
+            """,
+            (job["owner"], job["repo"], job.get("pr_number")),
+        ).fetchone()
+
+        if row:
+            conn.execute(
+                """
+                UPDATE dead_letters
+                SET stage = ?, job = ?, error = ?, failures = failures + 1, updated_at = ?
+                WHERE id = ?
+                """,
+                (stage, json.dumps(job), error, now, row["id"]),
+            )
+            return row["id"]
+
+        cur = conn.execute(
+            """
+            INSERT INTO dead_letters (owner, repo, pr_number, stage, job, error, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (job["owner"], job["repo"], job.get("pr_number"), stage, json.dumps(job), error, now, now),
+        )
+        return cur.lastrowid
+
+
+def pending(db_path: Optional[str] = None) -> list[Dict[str, Any]]:
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute("SELECT * FROM dead_letters WHERE status = 'pending' ORDER BY id").fetchall()
+    return [
+        {
+            "id": r["id"],
+            "stage": r["stage"],
+            "job": json.loads(r["job"]),
+            "error": r["error"],
+            "failures": r["failures"],
+        }
+        for r in rows
+    ]
+
+
+def _close(letter_id: int, status: str, error: Optional[str], db_path: Optional[str]) -> None:
+    with closing(_connect(db_path)) as conn, conn:
+        conn.execute(
+            "UPDATE dead_letters SET status = ?, error = COALESCE(?, error), resolved_at = ? WHERE id = ?",
+            (status, error, _now(), letter_id),
+        )
+
+
+def resolve(letter_id: int, db_path: Optional[str] = None) -> None:
+    _close(letter_id, "resolved", None, db_path)
+
+
+def fail(letter_id: int, error: str, db_path: Optional[str] = None) -> None:
+    """
+    Closes an entry that failed permanently on replay (e.g. a reverted tx), keeping its error.
+    """
+    _close(letter_id, "failed", error, db_path)
+
+
+def import_from(src_db_path: str, source: str, db_path: Optional[str] = None) -> int:
+    """
+    Copies the pending entries of another store (e.g. one uploaded by a single workflow run)
+    into this one. Each source is imported at most once, so repeating an import is a no-op.
+    """
+    with closing(_connect(src_db_path)) as src:
+        rows = src.execute("SELECT * FROM dead_letters WHERE status = 'pending' ORDER BY id").fetchall()
+
+    with closing(_connect(db_path)) as conn, conn:
+        if conn.execute("SELECT 1 FROM imports WHERE source = ?", (source,)).fetchone():
+            return 0
+        for r in rows:
+            conn.execute(
+                """
+                INSERT INTO dead_letters (owner, repo, pr_number, stage, job, error, failures, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (r["owner"], r["repo"], r["pr_number"], r["stage"], r["job"], r["error"], r["failures"], r["created_at"], r["updated_at"]),
+            )
+        conn.execute("INSERT INTO imports (source, imported_at) VALUES (?, ?)", (source, _now()))
+    return len(rows)
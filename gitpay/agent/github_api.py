@@ -1,6 +1,6 @@
 import os
 import requests
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
 
 GITHUB_API = "https://api.github.com"
 
@@ -25,6 +25,36 @@ def get_issue(owner: str, repo: str, issue_number: int) -> Dict[str, Any]:
     return r.json()
 
 
+def list_issues_page(
+    owner: str,
+    repo: str,
+    since: Optional[str] = None,
+    etag: Optional[str] = None,
+    url: Optional[str] = None,
+) -> Tuple[Optional[list[Dict[str, Any]]], Optional[str], Optional[str]]:
+    """
+    Fetches one page of issues updated at or after `since`.
+    Returns (issues, etag, next_url); issues is None on 304 Not Modified.
+    """
+    headers = _headers()
+    if etag:
+        headers["If-None-Match"] = etag
+
+    params = None
+    if not url:
+        url = f"{GITHUB_API}/repos/{owner}/{repo}/issues"
+        params = {"state": "all", "sort": "updated", "direction": "asc", "per_page": 100}
+        if since:
+            params["since"] = since
+
+    r = requests.get(url, headers=headers, params=params, timeout=20)
+    if r.status_code == 304:
+        return None, etag, None
+    r.raise_for_status()
+    next_url = (r.links.get("next") or {}).get("url")
+    return r.json(), r.headers.get("ETag"), next_url
+
+
 def issue_has_label(issue: Dict[str, Any], label: str) -> bool:
     labels = issue.get("labels", []) or []
     return any((l.get("name") or "").lower() == label.lower() for l in labels)
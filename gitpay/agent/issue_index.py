@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import logging
+import sqlite3
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional
+
+import requests
+
+import github_api
+import local_store
+from pr_parser import parse_bounty_from_issue_title
+
+logger = logging.getLogger("gitpay.index")
+
+DEFAULT_DB_PATH = "gitpay_index.db"
+DEFAULT_MAX_AGE = 3600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    bounty TEXT,
+    labels TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (owner, repo, number)
+);
+CREATE INDEX IF NOT EXISTS idx_issues_bounty ON issues (owner, repo, state, bounty);
+CREATE TABLE IF NOT EXISTS sync_state (
+    owner TEXT NOT NULL,
+    repo TEXT NOT NULL,
+    since TEXT,
+    etag TEXT,
+    synced_at REAL,
+    PRIMARY KEY (owner, repo)
+);
+"""
+
+
+def _connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    return local_store.connect(SCHEMA, "GITPAY_INDEX_DB", DEFAULT_DB_PATH, db_path)
+
+
+def _upsert_issue(conn: sqlite3.Connection, owner: str, repo: str, issue: Dict[str, Any]) -> None:
+    title = issue.get("title") or ""
+    labels = [l.get("name") for l in (issue.get("labels") or []) if l.get("name")]
+    conn.execute(
+        """
+        INSERT INTO issues (owner, repo, number, title, bounty, labels, state, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (owner, repo, number) DO UPDATE SET
+            title = excluded.title,
+            bounty = excluded.bounty,
+            labels = excluded.labels,
+            state = excluded.state,
+            updated_at = excluded.updated_at
+        """,
+        (
+            owner,
+            repo,
+            int(issue["number"]),
+            title,
+            parse_bounty_from_issue_title(title),
+            json.dumps(labels),
+            issue.get("state") or "open",
+            issue.get("updated_at") or "",
+        ),
+    )
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "number": row["number"],
+        "title": row["title"],
+        "bounty": row["bounty"],
+        "labels": json.loads(row["labels"]),
+        "state": row["state"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def sync_issues(owner: str, repo: str, db_path: Optional[str] = None) -> int:
+    """
+    Pulls only issues updated since the last sync into the local index.
+    Returns the number of issues written (0 when GitHub answers 304).
+    """
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT since, etag FROM sync_state WHERE owner = ? AND repo = ?", (owner, repo)
+        ).fetchone()
+        since = row["since"] if row else None
+        etag = row["etag"] if row else None
+
+        issues, new_etag, next_url = github_api.list_issues_page(owner, repo, since=since, etag=etag)
+        if issues is None:
+            with conn:
+                conn.execute(
+                    "UPDATE sync_state SET synced_at = ? WHERE owner = ? AND repo = ?", (time.time(), owner, repo)
+                )
+            logger.info(f"📇 Index up to date for {owner}/{repo} (304 Not Modified)")
+            return 0
+
+        written = 0
+        latest = since
+        with conn:
+            while True:
+                for issue in issues:
+                    updated_at = issue.get("updated_at")
+                    if updated_at and (latest is None or updated_at > latest):
+                        latest = updated_at
+                    # The issues endpoint also returns pull requests
+                    if "pull_request" in issue:
+                        continue
+                    _upsert_issue(conn, owner, repo, issue)
+                    written += 1
+
+                if not next_url:
+                    break
+                issues, _, next_url = github_api.list_issues_page(owner, repo, url=next_url)
+
+            # The ETag is only valid for the same `since` URL, so keep it only if the window didn't move
+            conn.execute(
+                """
+                INSERT INTO sync_state (owner, repo, since, etag, synced_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (owner, repo) DO UPDATE SET
+                    since = excluded.since, etag = excluded.etag, synced_at = excluded.synced_at
+                """,
+                (owner, repo, latest, new_etag if latest == since else None, time.time()),
+            )
+
+        logger.info(f"📇 Indexed {written} issue(s) for {owner}/{repo} (since={since})")
+        return written
+
+
+def get_indexed_issue(owner: str, repo: str, issue_number: int, db_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT * FROM issues WHERE owner = ? AND repo = ? AND number = ?",
+            (owner, repo, int(issue_number)),
+        ).fetchone()
+    return _row_to_dict(row) if row else None
+
+
+def _synced_at(owner: str, repo: str, db_path: Optional[str] = None) -> Optional[float]:
+    with closing(_connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT synced_at FROM sync_state WHERE owner = ? AND repo = ?", (owner, repo)
+        ).fetchone()
+    return row["synced_at"] if row else None
+
+
+def lookup_issue(
+    owner: str,
+    repo: str,
+    issue_number: int,
+    db_path: Optional[str] = None,
+    max_age: Optional[float] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Payout-time lookup served from the local index. GitHub is only asked on a miss or when the
+    last sync is older than max_age seconds (GITPAY_INDEX_MAX_AGE, default 1h), and a failed sync
+    falls back to the indexed row. Returns None if the issue is not indexed (unknown number or a PR).
+    """
+    if max_age is None:
+        max_age = float(os.getenv("GITPAY_INDEX_MAX_AGE", DEFAULT_MAX_AGE))
+
+    found = get_indexed_issue(owner, repo, issue_number, db_path)
+    synced_at = _synced_at(owner, repo, db_path)
+    if found and synced_at is not None and time.time() - synced_at <= max_age:
+        return found
+
+    try:
+        sync_issues(owner, repo, db_path)
+    except (requests.RequestException, RuntimeError) as e:
+        logger.warning(f"📇 Index sync for {owner}/{repo} failed, serving indexed data: {e}")
+        return found
+
+    return get_indexed_issue(owner, repo, issue_number, db_path)
+
+
+def list_bounty_issues(owner: str, repo: str, state: Optional[str] = "open", db_path: Optional[str] = None) -> list[Dict[str, Any]]:
+    """
+    Issues whose title carries a bounty tag, e.g. '[50 USDC] Fix login'.
+    Pass state=None to include closed issues.
+    """
+    query = "SELECT * FROM issues WHERE owner = ? AND repo = ? AND bounty IS NOT NULL"
+    params: list[Any] = [owner, repo]
+    if state:
+        query += " AND state = ?"
+        params.append(state)
+    query += " ORDER BY number"
+
+    with closing(_connect(db_path)) as conn:
+        return [_row_to_dict(r) for r in conn.execute(query, params).fetchall()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    owner = os.getenv("GITHUB_REPO_OWNER", "souvik0908")
+    repo = os.getenv("GITHUB_REPO_NAME", "Gitpay")
+    if len(sys.argv) == 3:
+        owner, repo = sys.argv[1], sys.argv[2]
+
+    sync_issues(owner, repo)
+    for item in list_bounty_issues(owner, repo):
+        print(f"#{item['number']} {item['bounty']:>12}  {item['title']}")
@@ -0,0 +1,13 @@
+import os
+import sqlite3
+from typing import Optional
+
+
+def connect(schema: str, env_var: str, default_path: str, db_path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Opens a SQLite store at db_path, else $env_var, else default_path, and applies its schema.
+    """
+    conn = sqlite3.connect(db_path or os.getenv(env_var, default_path))
+    conn.row_factory = sqlite3.Row
+    conn.executescript(schema)
+    return conn
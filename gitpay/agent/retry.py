@@ -0,0 +1,117 @@
+import time
+import random
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("gitpay.retry")
+
+
+class TransientError(Exception):
+    """A dependency failure that is worth retrying (timeouts, 5xx, RPC hiccups)."""
+
+
+class StageFailed(Exception):
+    """Raised when a stage exhausts its retries or its dependency's circuit is open."""
+
+    def __init__(self, stage: str, error: str):
+        super().__init__(f"{stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 30.0
+    multiplier: float = 2.0
+
+    def delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter for the given 1-based attempt.
+        """
+        cap = min(self.max_delay, self.base_delay * (self.multiplier ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+
+class CircuitBreaker:
+    """
+    Per-dependency breaker: opens after `failure_threshold` consecutive failures
+    and lets a single trial call through once `reset_timeout` seconds have passed.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go ahead. Claims the half-open trial, so once the cool-down has
+        passed only the first caller gets True until that trial is recorded.
+        """
+        if self.opened_at is None:
+            return True
+        if self.trial_in_flight or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        # A failed trial re-opens the circuit for another cool-down
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"⚡ Circuit '{self.name}' opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+def run_stage(stage: str, fn: Callable[..., Any], policy: RetryPolicy, breaker: CircuitBreaker, *args, **kwargs) -> Any:
+    """
+    Calls fn(*args, **kwargs), retrying TransientError per `policy` while `breaker` allows.
+    Any other exception propagates unchanged.
+    """
+    last_error = "no attempts made"
+    for attempt in range(1, policy.max_attempts + 1):
+        if not breaker.allow():
+            raise StageFailed(stage, f"circuit '{breaker.name}' is open ({last_error})")
+
+        try:
+            result = fn(*args, **kwargs)
+        except TransientError as e:
+            breaker.record_failure()
+            last_error = str(e)
+            if breaker.is_open:
+                raise StageFailed(stage, f"circuit '{breaker.name}' is open ({last_error})")
+            if attempt == policy.max_attempts:
+                break
+            wait = policy.delay(attempt)
+            logger.warning(f"🔁 Stage '{stage}' attempt {attempt}/{policy.max_attempts} failed: {e}. Retrying in {wait:.1f}s")
+            time.sleep(wait)
+            continue
+        except Exception:
+            # Says nothing about the dependency's health; just free the trial slot
+            breaker.release_trial()
+            raise
+
+        breaker.record_success()
+        return result
+
+    raise StageFailed(stage, f"retries exhausted after {policy.max_attempts} attempts ({last_error})")
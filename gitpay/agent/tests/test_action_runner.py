@@ -0,0 +1,355 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+from eth_account import Account
+from web3 import Web3
+from web3.exceptions import TimeExhausted, TransactionNotFound
+
+import action_runner
+import dead_letter
+import retry
+
+PAYEE = "0x9496c5bB7397536Ae4aD729D88bA24d4c22DcF48"
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch, tmp_path):
+    monkeypatch.setenv("GITPAY_DLQ_DB", str(tmp_path / "dlq.db"))
+    monkeypatch.setenv("X402_SERVICE_URL", "http://x402.test")
+    monkeypatch.setenv("CRONOS_PRIVATE_KEY", Account.create().key.hex())
+    monkeypatch.delenv("GITPAY_DRY_RUN", raising=False)
+    monkeypatch.setattr(retry.time, "sleep", lambda s: None)
+    for breaker in action_runner.BREAKERS.values():
+        breaker.record_success()
+
+
+# --- Funding check ---
+
+def _response(status, body):
+    resp = SimpleNamespace(status_code=status)
+
+    def json():
+        if isinstance(body, Exception):
+            raise body
+        return body
+
+    resp.json = json
+    return resp
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_funding_retryable_statuses_are_transient(monkeypatch, status):
+    monkeypatch.setattr(action_runner.requests, "get", lambda *a, **k: _response(status, {}))
+    with pytest.raises(retry.TransientError):
+        action_runner.check_funding_status("o", "r", 1)
+
+
+def test_funding_connection_error_is_transient(monkeypatch):
+    def down(*a, **k):
+        raise requests.ConnectionError("refused")
+
+    monkeypatch.setattr(action_runner.requests, "get", down)
+    with pytest.raises(retry.TransientError):
+        action_runner.check_funding_status("o", "r", 1)
+
+
+@pytest.mark.parametrize(
+    "status, body, expected",
+    [
+        (200, {"ok": True, "funded": True, "record": {"amountBaseUnits": "1500000"}}, (True, 1500000)),
+        (404, {"ok": True, "funded": False}, (False, 0)),
+        (404, ValueError("html page"), (None, 0)),
+        (401, {"error": "unauthorized"}, (None, 0)),
+        (403, {"error": "forbidden"}, (None, 0)),
+        (200, {"funded": True, "record": "oops"}, (None, 0)),
+        (200, {"funded": True, "record": {}}, (None, 0)),
+        (200, ["not", "a", "dict"], (None, 0)),
+    ],
+)
+def test_funding_only_explicit_404_means_not_funded(monkeypatch, status, body, expected):
+    monkeypatch.setattr(action_runner.requests, "get", lambda *a, **k: _response(status, body))
+    assert action_runner.check_funding_status("o", "r", 1) == expected
+
+
+# --- Payout ---
+
+class FakeEth:
+    def __init__(self):
+        self.account = Account
+        self.gas_price = 5000
+        self.nonce = 0
+        self.known = set()
+        self.sends = []
+        self.send_errors = []
+        self.receipt_errors = []
+        self.receipt_status = 1
+        self.drop_on_timeout = False
+
+    def get_transaction_count(self, address, block="latest"):
+        return self.nonce
+
+    def contract(self, address, abi):
+        return Web3().eth.contract(address=address, abi=abi)
+
+    def get_transaction(self, tx_hash):
+        if tx_hash not in self.known:
+            raise TransactionNotFound(tx_hash)
+        return {"hash": tx_hash}
+
+    def send_raw_transaction(self, raw_tx):
+        self.sends.append(raw_tx)
+        error = self.send_errors.pop(0) if self.send_errors else None
+        # A refused connection or a rejection never reaches the pool; a read timeout may have
+        if error is None or isinstance(error, requests.ReadTimeout):
+            self.known.add(Web3.to_hex(Web3.keccak(hexstr=raw_tx)))
+        if error:
+            raise error
+
+    def wait_for_transaction_receipt(self, tx_hash):
+        if self.receipt_errors:
+            if self.drop_on_timeout:
+                self.known.discard(tx_hash)
+            raise self.receipt_errors.pop(0)
+        return SimpleNamespace(status=self.receipt_status)
+
+
+@pytest.fixture
+def chain(monkeypatch):
+    eth = FakeEth()
+    monkeypatch.setattr(action_runner, "_connect_web3", lambda: SimpleNamespace(eth=eth))
+    return eth
+
+
+@pytest.fixture
+def funded(monkeypatch):
+    monkeypatch.setattr(action_runner, "extract_details_with_agent", lambda text: (5, PAYEE))
+    monkeypatch.setattr(action_runner, "check_funding_status", lambda o, r, i: (True, 1000000))
+
+
+@pytest.fixture
+def signs(monkeypatch):
+    calls = []
+    real = action_runner.sign_payout
+
+    def counting(*args):
+        calls.append(args)
+        return real(*args)
+
+    monkeypatch.setattr(action_runner, "sign_payout", counting)
+    return calls
+
+
+def _job():
+    return {"owner": "o", "repo": "r", "pr_number": 7, "pr_context": "Closes #5"}
+
+
+def test_sign_payout_hash_is_keccak_of_raw_tx(chain):
+    raw_tx, tx_hash = action_runner.sign_payout(PAYEE, 1000000)
+    assert tx_hash == Web3.to_hex(Web3.keccak(hexstr=raw_tx))
+    assert chain.sends == []
+
+
+def test_pipeline_pays_once(chain, funded, signs):
+    job = _job()
+    assert action_runner.run_pipeline(job)
+    assert len(signs) == 1
+    assert chain.sends == [job["raw_tx"]]
+
+
+def test_send_timeout_after_node_accepted_is_not_resent(chain, funded, signs):
+    # The node got the tx but the client timed out; the retry must find it by hash
+    chain.send_errors = [requests.ReadTimeout("read timed out")]
+    job = _job()
+    assert action_runner.run_pipeline(job)
+    assert len(chain.sends) == 1
+    assert len(signs) == 1
+
+
+@pytest.mark.parametrize("message", ["already known", "insufficient funds for gas"])
+def test_node_rejections_are_permanent(chain, funded, message):
+    chain.send_errors = [ValueError({"code": -32000, "message": message})]
+    job = _job()
+    assert not action_runner.run_pipeline(job)
+    assert len(chain.sends) == 1
+    assert job["error"].startswith("payout:")
+
+
+def test_replay_resumes_at_payout_with_the_same_signed_tx(chain, funded, signs):
+    chain.send_errors = [requests.ConnectionError("refused")] * 5
+    job = _job()
+    with pytest.raises(retry.StageFailed) as exc:
+        action_runner.run_pipeline(job)
+    assert exc.value.stage == "payout"
+    dead_letter.record(job, exc.value.stage, exc.value.error)
+
+    chain.send_errors = []
+    for breaker in action_runner.BREAKERS.values():
+        breaker.record_success()
+
+    assert action_runner.replay_dead_letters()
+    assert len(signs) == 1
+    # Every attempt, including the replay, sent the very same signed bytes
+    assert set(chain.sends) == {job["raw_tx"]}
+    assert len(chain.known) == 1
+    assert dead_letter.pending() == []
+
+
+def test_replay_resigns_when_another_payout_took_the_nonce(chain, funded, signs):
+    chain.send_errors = [requests.ConnectionError("refused")] * 3
+    job = _job()
+    with pytest.raises(retry.StageFailed) as exc:
+        action_runner.run_pipeline(job)
+    first_hash = job["tx_hash"]
+    dead_letter.record(job, exc.value.stage, exc.value.error)
+    for breaker in action_runner.BREAKERS.values():
+        breaker.record_success()
+
+    # A later payout run got nonce 0 mined first, so the stored tx can never be mined
+    chain.nonce = 1
+    chain.send_errors = [ValueError({"code": -32000, "message": "nonce too low"})]
+
+    assert action_runner.replay_dead_letters()
+    assert len(signs) == 2
+    # The replay sent a freshly signed tx, not the stale one
+    resigned = chain.sends[-1]
+    assert resigned != job["raw_tx"]
+    assert Web3.to_hex(Web3.keccak(hexstr=resigned)) != first_hash
+    assert dead_letter.pending() == []
+
+
+def test_rejected_tx_that_is_known_is_not_resigned(chain, funded, signs):
+    # "nonce too low" for our own already-mined tx must not lead to a second payout
+    job = _job()
+    chain.send_errors = [ValueError({"code": -32000, "message": "nonce too low"})]
+    real_send = chain.send_raw_transaction
+
+    def send_then_mine(raw_tx):
+        chain.known.add(Web3.to_hex(Web3.keccak(hexstr=raw_tx)))
+        return real_send(raw_tx)
+
+    chain.send_raw_transaction = send_then_mine
+    assert not action_runner.run_pipeline(job)
+    assert len(signs) == 1
+
+
+def test_replay_resumes_at_confirm_without_sending(chain, funded, signs):
+    chain.receipt_errors = [TimeExhausted("still pending")] * 5
+    job = _job()
+    with pytest.raises(retry.StageFailed) as exc:
+        action_runner.run_pipeline(job)
+    assert exc.value.stage == "confirm"
+    dead_letter.record(job, exc.value.stage, exc.value.error)
+    for breaker in action_runner.BREAKERS.values():
+        breaker.record_success()
+
+    assert action_runner.replay_dead_letters()
+    assert len(signs) == 1
+    assert len(chain.sends) == 1
+    assert dead_letter.pending() == []
+
+
+def test_dropped_tx_is_resent_with_the_same_bytes(chain, funded, signs):
+    chain.receipt_errors = [TimeExhausted("not found")]
+    chain.drop_on_timeout = True
+    job = _job()
+    assert action_runner.run_pipeline(job)
+    assert len(signs) == 1
+    assert chain.sends == [job["raw_tx"], job["raw_tx"]]
+
+
+def test_tx_that_keeps_dropping_is_dead_lettered_at_payout(chain, funded, signs):
+    chain.receipt_errors = [TimeExhausted("not found")] * action_runner.MAX_PAYOUT_ROUNDS
+    chain.drop_on_timeout = True
+    with pytest.raises(retry.StageFailed) as exc:
+        action_runner.run_pipeline(_job())
+    assert exc.value.stage == "payout"
+    assert len(signs) == 1
+
+
+def test_replay_marks_reverted_payout_failed(chain, funded):
+    chain.receipt_errors = [TimeExhausted("still pending")] * 5
+    job = _job()
+    with pytest.raises(retry.StageFailed) as exc:
+        action_runner.run_pipeline(job)
+    dead_letter.record(job, exc.value.stage, exc.value.error)
+    for breaker in action_runner.BREAKERS.values():
+        breaker.record_success()
+
+    chain.receipt_status = 0
+    assert not action_runner.replay_dead_letters()
+    assert dead_letter.pending() == []
+    # A later replay has nothing left to run
+    assert action_runner.replay_dead_letters()
+
+
+# --- Gemini errors ---
+
+class _HTTPError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def _wrapped(code):
+    # Mirrors the client wrapping the raw HTTP error in its own exception type
+    try:
+        raise _HTTPError(code)
+    except _HTTPError as inner:
+        try:
+            raise RuntimeError("Error calling model") from inner
+        except RuntimeError as outer:
+            return outer
+
+
+@pytest.mark.parametrize(
+    "error, retryable",
+    [
+        (_wrapped(429), True),
+        (_wrapped(503), True),
+        (requests.Timeout("slow"), True),
+        (_wrapped(400), False),
+        (_wrapped(401), False),
+        (_wrapped(403), False),
+        (_wrapped(404), False),
+        (KeyError("bug"), False),
+    ],
+)
+def test_only_retryable_gemini_errors_are_transient(monkeypatch, error, retryable):
+    monkeypatch.setenv("GOOGLE_API_KEY", "key")
+
+    class FakeLLM:
+        def __init__(self, **kwargs):
+            pass
+
+        def invoke(self, messages):
+            raise error
+
+    monkeypatch.setattr(action_runner, "ChatGoogleGenerativeAI", FakeLLM)
+    if retryable:
+        with pytest.raises(retry.TransientError):
+            action_runner.extract_details_with_agent("Closes #5")
+    else:
+        assert action_runner.extract_details_with_agent("Closes #5") == (None, None)
+
+
+def test_replay_gives_up_after_max_failures(monkeypatch):
+    monkeypatch.setenv("GITPAY_DLQ_MAX_FAILURES", "3")
+    monkeypatch.setattr(action_runner, "extract_details_with_agent", lambda text: (5, PAYEE))
+
+    def down(o, r, i):
+        raise retry.TransientError("tunnel gone")
+
+    monkeypatch.setattr(action_runner, "check_funding_status", down)
+    job = dict(_job(), issue_num=5, wallet=PAYEE)
+    dead_letter.record(job, "funding", "tunnel gone")
+
+    # Failures 2 and 3 come from replays; the next replay closes the entry without running it
+    for failures in (2, 3):
+        for breaker in action_runner.BREAKERS.values():
+            breaker.record_success()
+        assert not action_runner.replay_dead_letters()
+        assert [l["failures"] for l in dead_letter.pending()] == [failures]
+
+    assert not action_runner.replay_dead_letters()
+    assert dead_letter.pending() == []
@@ -0,0 +1,55 @@
+import pytest
+
+import dead_letter
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "dlq.db")
+
+
+JOB = {"owner": "o", "repo": "r", "pr_number": 7, "pr_context": "x"}
+
+
+def test_record_and_pending(db):
+    letter_id = dead_letter.record(dict(JOB, issue_num=5), "funding", "down", db)
+    [letter] = dead_letter.pending(db)
+    assert letter["id"] == letter_id
+    assert letter["stage"] == "funding"
+    assert letter["job"]["issue_num"] == 5
+    assert letter["failures"] == 1
+
+
+def test_record_again_updates_pending_entry(db):
+    first = dead_letter.record(JOB, "funding", "down", db)
+    second = dead_letter.record(dict(JOB, tx_hash="0xabc"), "confirm", "timeout", db)
+    assert first == second
+    [letter] = dead_letter.pending(db)
+    assert letter["stage"] == "confirm"
+    assert letter["job"]["tx_hash"] == "0xabc"
+    assert letter["failures"] == 2
+
+
+def test_resolve_and_fail_close_entries(db):
+    resolved = dead_letter.record(JOB, "payout", "down", db)
+    dead_letter.resolve(resolved, db)
+    failed = dead_letter.record(dict(JOB, pr_number=8), "confirm", "timeout", db)
+    dead_letter.fail(failed, "confirm: reverted", db)
+
+    assert dead_letter.pending(db) == []
+    # A new failure for a closed PR opens a fresh entry
+    assert dead_letter.record(JOB, "payout", "down", db) not in (resolved, failed)
+
+
+def test_import_from_copies_pending_entries_once(db, tmp_path):
+    run_db = str(tmp_path / "run.db")
+    dead_letter.record(dict(JOB, tx_hash="0xabc"), "confirm", "timeout", run_db)
+    done = dead_letter.record(dict(JOB, pr_number=8), "payout", "down", run_db)
+    dead_letter.resolve(done, run_db)
+
+    assert dead_letter.import_from(run_db, "gitpay-dead-letters-1", db) == 1
+    assert dead_letter.import_from(run_db, "gitpay-dead-letters-1", db) == 0
+
+    [letter] = dead_letter.pending(db)
+    assert letter["stage"] == "confirm"
+    assert letter["job"]["tx_hash"] == "0xabc"
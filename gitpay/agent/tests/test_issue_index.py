@@ -0,0 +1,103 @@
+import pytest
+import requests
+
+import github_api
+import issue_index
+
+
+def _issue(number, title, updated_at, state="open", labels=(), pr=False):
+    issue = {
+        "number": number,
+        "title": title,
+        "state": state,
+        "updated_at": updated_at,
+        "labels": [{"name": l} for l in labels],
+    }
+    if pr:
+        issue["pull_request"] = {}
+    return issue
+
+
+class FakeGitHub:
+    def __init__(self):
+        self.issues = []
+        self.calls = []
+
+    def list_issues_page(self, owner, repo, since=None, etag=None, url=None):
+        self.calls.append({"since": since, "etag": etag, "url": url})
+        page = [i for i in self.issues if since is None or i["updated_at"] >= since]
+        current = f'"{since}:{len(page)}:{[i["title"] for i in page]}"'
+        if etag == current:
+            return None, etag, None
+        return page, current, None
+
+
+@pytest.fixture
+def gh(monkeypatch):
+    fake = FakeGitHub()
+    monkeypatch.setattr(github_api, "list_issues_page", fake.list_issues_page)
+    return fake
+
+
+@pytest.fixture
+def db(tmp_path):
+    return str(tmp_path / "index.db")
+
+
+def test_sync_indexes_issues_and_skips_pull_requests(gh, db):
+    gh.issues = [
+        _issue(1, "[50 USDC] Fix login", "2026-01-01T00:00:00Z", labels=["bounty"]),
+        _issue(2, "Docs typo", "2026-01-02T00:00:00Z"),
+        _issue(3, "Some PR", "2026-01-03T00:00:00Z", pr=True),
+    ]
+
+    assert issue_index.sync_issues("o", "r", db) == 2
+    assert issue_index.get_indexed_issue("o", "r", 1, db)["bounty"] == "50 USDC"
+    assert issue_index.get_indexed_issue("o", "r", 1, db)["labels"] == ["bounty"]
+    assert issue_index.get_indexed_issue("o", "r", 3, db) is None
+    assert [i["number"] for i in issue_index.list_bounty_issues("o", "r", db_path=db)] == [1]
+
+
+def test_sync_is_incremental_and_uses_etag(gh, db):
+    gh.issues = [_issue(1, "[50 USDC] Fix login", "2026-01-01T00:00:00Z")]
+    issue_index.sync_issues("o", "r", db)
+    # The window moved, so the next sync re-reads only the newest issue and stores its ETag
+    issue_index.sync_issues("o", "r", db)
+    assert issue_index.sync_issues("o", "r", db) == 0
+
+    assert gh.calls[1]["since"] == "2026-01-01T00:00:00Z"
+    assert gh.calls[1]["etag"] is None
+    assert gh.calls[2]["etag"] is not None
+
+
+def test_lookup_issue_reads_fresh_index_without_github(gh, db):
+    gh.issues = [_issue(1, "[50 USDC] Fix login", "2026-01-01T00:00:00Z")]
+    # A miss syncs
+    assert issue_index.lookup_issue("o", "r", 1, db)["bounty"] == "50 USDC"
+    calls = len(gh.calls)
+
+    assert issue_index.lookup_issue("o", "r", 1, db)["bounty"] == "50 USDC"
+    assert len(gh.calls) == calls
+
+
+def test_lookup_issue_resyncs_stale_index(gh, db):
+    gh.issues = [_issue(1, "[50 USDC] Fix login", "2026-01-01T00:00:00Z")]
+    issue_index.sync_issues("o", "r", db)
+
+    gh.issues = [_issue(1, "[75 USDC] Fix login", "2026-01-05T00:00:00Z", state="closed")]
+    found = issue_index.lookup_issue("o", "r", 1, db, max_age=0)
+    assert found["bounty"] == "75 USDC"
+    assert found["state"] == "closed"
+    assert issue_index.lookup_issue("o", "r", 99, db) is None
+
+
+def test_lookup_issue_serves_index_when_github_is_down(gh, db, monkeypatch):
+    gh.issues = [_issue(1, "[50 USDC] Fix login", "2026-01-01T00:00:00Z")]
+    issue_index.sync_issues("o", "r", db)
+
+    def down(*args, **kwargs):
+        raise requests.ConnectionError("github unreachable")
+
+    monkeypatch.setattr(github_api, "list_issues_page", down)
+    assert issue_index.lookup_issue("o", "r", 1, db, max_age=0)["bounty"] == "50 USDC"
+    assert issue_index.lookup_issue("o", "r", 2, db) is None
@@ -0,0 +1,117 @@
+import pytest
+
+import retry
+from retry import CircuitBreaker, RetryPolicy, StageFailed, TransientError, run_stage
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(retry.time, "sleep", calls.append)
+    # Take the top of the jitter range so delays are deterministic
+    monkeypatch.setattr(retry.random, "uniform", lambda lo, hi: hi)
+    return calls
+
+
+def flaky(failures, result="ok"):
+    state = {"calls": 0}
+
+    def fn():
+        state["calls"] += 1
+        if state["calls"] <= failures:
+            raise TransientError("down")
+        return result
+
+    return fn, state
+
+
+def test_backoff_is_exponential_and_capped(sleeps):
+    policy = RetryPolicy(base_delay=1.0, multiplier=2.0, max_delay=5.0)
+    assert [policy.delay(n) for n in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+
+
+def test_retries_transient_errors_with_backoff(sleeps):
+    fn, state = flaky(2)
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0, multiplier=2.0)
+    assert run_stage("s", fn, policy, CircuitBreaker("dep", failure_threshold=3)) == "ok"
+    assert state["calls"] == 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_exhausted_retries_raise_stage_failed(sleeps):
+    fn, state = flaky(10)
+    with pytest.raises(StageFailed) as exc:
+        run_stage("s", fn, RetryPolicy(max_attempts=3), CircuitBreaker("dep", failure_threshold=10))
+    assert exc.value.stage == "s"
+    assert state["calls"] == 3
+
+
+def test_other_exceptions_are_not_retried(sleeps):
+    def boom():
+        raise KeyError("bug")
+
+    with pytest.raises(KeyError):
+        run_stage("s", boom, RetryPolicy(max_attempts=3), CircuitBreaker("dep"))
+    assert sleeps == []
+
+
+def test_breaker_threshold_matching_policy_allows_every_attempt(sleeps):
+    fn, state = flaky(10)
+    with pytest.raises(StageFailed):
+        run_stage("s", fn, RetryPolicy(max_attempts=5), CircuitBreaker("dep", failure_threshold=5))
+    assert state["calls"] == 5
+
+
+def test_open_breaker_fails_fast_and_half_opens_after_timeout(sleeps, monkeypatch):
+    now = {"t": 100.0}
+    monkeypatch.setattr(retry.time, "monotonic", lambda: now["t"])
+    breaker = CircuitBreaker("dep", failure_threshold=2, reset_timeout=60)
+
+    fn, state = flaky(10)
+    with pytest.raises(StageFailed, match="circuit 'dep' is open"):
+        run_stage("s", fn, RetryPolicy(max_attempts=5), breaker)
+    assert state["calls"] == 2
+
+    # Still open: no call is made at all
+    with pytest.raises(StageFailed):
+        run_stage("s", fn, RetryPolicy(max_attempts=5), breaker)
+    assert state["calls"] == 2
+
+    # After the cool-down a trial call goes through and closes the circuit
+    now["t"] += 61
+    ok, _ = flaky(0)
+    assert run_stage("s", ok, RetryPolicy(max_attempts=1), breaker) == "ok"
+    assert breaker.allow() and breaker.failures == 0
+
+
+def test_half_open_breaker_lets_only_one_trial_through(monkeypatch):
+    now = {"t": 100.0}
+    monkeypatch.setattr(retry.time, "monotonic", lambda: now["t"])
+    breaker = CircuitBreaker("dep", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now["t"] += 61
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed trial re-opens the circuit for another cool-down
+    breaker.record_failure()
+    assert not breaker.allow()
+    now["t"] += 61
+    assert breaker.allow()
+
+
+def test_trial_is_released_when_the_call_raises_a_non_transient_error(sleeps, monkeypatch):
+    now = {"t": 100.0}
+    monkeypatch.setattr(retry.time, "monotonic", lambda: now["t"])
+    breaker = CircuitBreaker("dep", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    now["t"] += 61
+
+    def boom():
+        raise KeyError("bug")
+
+    with pytest.raises(KeyError):
+        run_stage("s", boom, RetryPolicy(max_attempts=1), breaker)
+    assert breaker.allow()